@@ -1,27 +1,75 @@
 import os
+import orjson
 from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from pymongo import MongoClient
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Startup checks give up quickly when MongoDB is unreachable instead of stalling worker boot
+# past gunicorn's timeout.
+STARTUP_SERVER_SELECTION_TIMEOUT_MS = 2000
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider that routes request parsing and jsonify through orjson."""
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode('utf-8')
+
+
 def create_app():
     app = Flask(__name__)
 
     # --- Configuration ---
     app.config["MONGO_URI"] = os.getenv("MONGO_URI")
     app.config["GITHUB_WEBHOOK_SECRET"] = os.getenv("GITHUB_WEBHOOK_SECRET")
+    # Encoded once here so signature verification doesn't re-encode per request.
+    app.config["GITHUB_WEBHOOK_SECRET_BYTES"] = (app.config["GITHUB_WEBHOOK_SECRET"] or "").encode('utf-8')
+    # Opt-in: queue events for batched, unacknowledged (w=0) writes. Trades durability for
+    # throughput, since a failed or unconfirmed batch is lost. Off by default.
+    app.config["FAST_INSERT"] = os.getenv("FAST_INSERT", "false").lower() in ("1", "true", "yes")
 
     if not app.config["MONGO_URI"]:
         app.logger.warning("MONGO_URI is not set. MongoDB functionality will be affected.")
 
     # --- Initialize Extensions ---
     from .extensions import mongo
+    from app.webhook.event_writer import init_events_cache
+    init_events_cache(app)
     try:
         mongo.init_app(app)
         app.logger.info("MongoDB initialized successfully.")
     except Exception as e:
         app.logger.error(f"Failed to initialize MongoDB: {e}")
 
+    if mongo.db is not None:
+        # Resolved once here so request handlers don't look it up through mongo.db on every call.
+        events_collection = mongo.db.events
+        app.extensions["events_collection"] = events_collection
+
+        from app.db_setup import RECENT_EVENTS_COLLECTION, is_recent_events_collection_ready
+        startup_client = MongoClient(app.config["MONGO_URI"],
+                                     serverSelectionTimeoutMS=STARTUP_SERVER_SELECTION_TIMEOUT_MS)
+        try:
+            if is_recent_events_collection_ready(startup_client[mongo.db.name], app.logger):
+                app.extensions["recent_events_collection"] = mongo.db[RECENT_EVENTS_COLLECTION]
+        finally:
+            startup_client.close()
+
+        if app.config["FAST_INSERT"]:
+            from app.webhook.event_writer import start_event_writer
+            start_event_writer(app)
+            app.logger.info("Background event writer started.")
+    else:
+        app.logger.error("MongoDB database is not available. Check MONGO_URI and initialization; events will not be stored.")
+
+    # Installed after PyMongo, whose init_app replaces app.json with its own BSON provider.
+    app.json = OrjsonProvider(app)
 
     # --- Register Blueprints ---
     from app.webhook.routes import webhook_bp
@@ -36,6 +84,15 @@ def create_app():
         app.logger.info("UI blueprint not found or not registered. UI will not be available via this blueprint.")
 
 
+    @app.cli.command("init-db")
+    def init_db():
+        """Creates indexes and the capped recent-events collection."""
+        from app.db_setup import setup_database
+        if mongo.db is None:
+            app.logger.error("MongoDB database is not available. Check MONGO_URI.")
+            return
+        setup_database(mongo.db, app.logger)
+
     @app.route('/health')
     def health_check():
         return "Webhook receiver is healthy!"
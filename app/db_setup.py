@@ -0,0 +1,78 @@
+from pymongo import DESCENDING
+from pymongo.errors import CollectionInvalid
+
+# Capped side collection holding only the newest events, read by the UI in insertion order.
+RECENT_EVENTS_COLLECTION = "events_recent"
+RECENT_EVENTS_MAX = 1000
+RECENT_EVENTS_SIZE_BYTES = 1_000_000
+
+
+def setup_database(db, logger):
+    """One-off setup of indexes and collections; kept out of create_app so worker boot never blocks on it.
+
+    Run once per deployment before any worker starts writing (gunicorn's on_starting hook or
+    `flask init-db`).
+    """
+    try:
+        # Serves the timestamp-sorted fallback read in /events and the seeding query below.
+        db.events.create_index([('timestamp', DESCENDING)])
+        logger.info("Ensured MongoDB index on events.timestamp.")
+    except Exception as e:
+        logger.error(f"Failed to create MongoDB index on events.timestamp: {e}")
+
+    setup_recent_events_collection(db, logger)
+
+
+def setup_recent_events_collection(db, logger):
+    """Creates the capped recent-events collection and seeds it from `events`.
+
+    An existing uncapped collection (e.g. auto-created by an insert) is dropped and rebuilt,
+    since it only mirrors `events`; convertToCapped can't apply the document limit.
+    Seeding while live events are appended would put the older, seeded events after them in
+    natural order, so this only runs from setup_database.
+    """
+    try:
+        recent = _create_capped(db)
+    except CollectionInvalid:
+        try:
+            if db[RECENT_EVENTS_COLLECTION].options().get('capped'):
+                return
+            logger.warning(f"{RECENT_EVENTS_COLLECTION} exists but is not capped; recreating it.")
+            db.drop_collection(RECENT_EVENTS_COLLECTION)
+            recent = _create_capped(db)
+        except Exception as e:
+            logger.error(f"Failed to recreate {RECENT_EVENTS_COLLECTION} as a capped collection: {e}")
+            return
+    except Exception as e:
+        logger.error(f"Failed to create capped collection {RECENT_EVENTS_COLLECTION}: {e}")
+        return
+
+    try:
+        latest = list(db.events.find().sort('timestamp', DESCENDING).limit(RECENT_EVENTS_MAX))
+        if latest:
+            latest.sort(key=lambda event: event.get('timestamp') or '')
+            recent.insert_many(latest)
+        logger.info(f"Created capped collection {RECENT_EVENTS_COLLECTION} with {len(latest)} existing event(s).")
+    except Exception as e:
+        logger.error(f"Failed to seed {RECENT_EVENTS_COLLECTION} from events: {e}")
+
+
+def _create_capped(db):
+    return db.create_collection(RECENT_EVENTS_COLLECTION, capped=True,
+                                size=RECENT_EVENTS_SIZE_BYTES, max=RECENT_EVENTS_MAX)
+
+
+def is_recent_events_collection_ready(db, logger):
+    """Checks that the recent-events collection exists and is capped.
+
+    When it isn't, callers skip it and read `events` sorted by timestamp instead. Never writing
+    to a missing collection keeps it from being auto-created uncapped.
+    """
+    try:
+        if db[RECENT_EVENTS_COLLECTION].options().get('capped'):
+            return True
+        logger.warning(f"{RECENT_EVENTS_COLLECTION} is missing or not capped; run `flask --app run init-db`. "
+                       "Serving events sorted by timestamp instead.")
+    except Exception as e:
+        logger.error(f"Failed to check {RECENT_EVENTS_COLLECTION}: {e}. Serving events sorted by timestamp instead.")
+    return False
@@ -0,0 +1,117 @@
+import atexit
+import queue
+import threading
+from pymongo import WriteConcern
+
+# Bound on events waiting for the background writer; once full, webhooks are stored synchronously.
+_EVENT_QUEUE_MAXSIZE = 10_000
+_FLUSH_MAX_BATCH = 500
+_FLUSH_WAIT_SECONDS = 0.05
+_FLUSH_ATTEMPTS = 2
+# How long shutdown waits for the writer to drain the queue.
+_SHUTDOWN_TIMEOUT_SECONDS = 10
+
+# Put on the queue at shutdown; the writer drains everything queued before it, then exits.
+_STOP = object()
+
+# After an unacknowledged flush, the version is bumped again once the queue has been idle
+# this long, by which time the writes have almost certainly been applied.
+_SETTLE_SECONDS = 1.0
+
+
+def init_events_cache(app):
+    """Sets up the per-app /events response cache and the version that invalidates it."""
+    app.extensions["events_cache"] = {
+        'version': 0,
+        'lock': threading.Lock(),
+        # (events version, built at, serialized body)
+        'entry': (-1, 0.0, b'[]'),
+    }
+
+
+def bump_events_version(app):
+    """Invalidates cached /events responses after events are written."""
+    cache = app.extensions["events_cache"]
+    with cache['lock']:
+        cache['version'] += 1
+
+
+def _write_batch(app, events, recent_events, buffer):
+    """Writes one batch, retrying once before giving up on it.
+
+    Retrying is safe: insert_many assigns _id to each document on the first attempt, so
+    documents that did land are rejected as duplicates and the unordered insert carries on.
+    """
+    for attempt in range(1, _FLUSH_ATTEMPTS + 1):
+        try:
+            events.insert_many(buffer, ordered=False)
+            break
+        except Exception as e:
+            app.logger.error(f"Error flushing {len(buffer)} event(s) to MongoDB (attempt {attempt}/{_FLUSH_ATTEMPTS}): {e}", exc_info=True)
+    else:
+        app.logger.error(f"Dropped {len(buffer)} event(s) after {_FLUSH_ATTEMPTS} failed attempts: "
+                         f"{[event.get('request_id') for event in buffer]}")
+        return
+
+    if recent_events is not None:
+        try:
+            recent_events.insert_many(buffer, ordered=False)
+        except Exception as e:
+            app.logger.error(f"Stored {len(buffer)} event(s) but failed to add them to the recent-events collection: {e}")
+    bump_events_version(app)
+    app.logger.info(f"Flushed {len(buffer)} event(s) to MongoDB.")
+
+
+def _flush_events(app, event_queue):
+    """Drains the queue into batched, unacknowledged insert_many calls until _STOP is queued."""
+    unacknowledged = WriteConcern(w=0)
+    events = app.extensions["events_collection"].with_options(write_concern=unacknowledged)
+    recent_events = app.extensions.get("recent_events_collection")
+    if recent_events is not None:
+        recent_events = recent_events.with_options(write_concern=unacknowledged)
+    item = event_queue.get()
+    while item is not _STOP:
+        buffer = [item]
+        item = None
+        try:
+            while len(buffer) < _FLUSH_MAX_BATCH:
+                next_item = event_queue.get(timeout=_FLUSH_WAIT_SECONDS)
+                if next_item is _STOP:
+                    item = _STOP
+                    break
+                buffer.append(next_item)
+        except queue.Empty:
+            pass
+
+        _write_batch(app, events, recent_events, buffer)
+        if item is None:
+            try:
+                item = event_queue.get(timeout=_SETTLE_SECONDS)
+            except queue.Empty:
+                # A GET between sending the w=0 batch and the server applying it may have
+                # cached a body without it under the new version; invalidate that.
+                bump_events_version(app)
+                item = event_queue.get()
+
+
+def stop_event_writer(app, thread, event_queue):
+    """Asks the writer to flush everything queued so far and waits for it to finish."""
+    event_queue.put(_STOP)
+    thread.join(_SHUTDOWN_TIMEOUT_SECONDS)
+    if thread.is_alive():
+        app.logger.error(f"Event writer did not finish within {_SHUTDOWN_TIMEOUT_SECONDS}s; "
+                         f"about {event_queue.qsize()} queued event(s) may be lost.")
+
+
+def start_event_writer(app):
+    """Creates the app's event queue and starts the thread that writes it to MongoDB.
+
+    The thread is a daemon so it can't hang the process, and an atexit handler drains the
+    queue on normal interpreter exit, including gunicorn graceful restarts and worker recycling.
+    """
+    event_queue = queue.Queue(maxsize=_EVENT_QUEUE_MAXSIZE)
+    app.extensions["event_queue"] = event_queue
+    thread = threading.Thread(target=_flush_events, args=(app, event_queue), name="event-writer", daemon=True)
+    thread.start()
+    atexit.register(stop_event_writer, app, thread, event_queue)
+    return thread
@@ -1,16 +1,98 @@
 import os
 import hmac
-import hashlib
-from flask import Blueprint, request, jsonify, current_app, abort
-from app.extensions import mongo
+import binascii
+import time
+import queue
+import orjson
+from bson.codec_options import CodecOptions
+from flask import Blueprint, request, jsonify, current_app, abort, g
+from app.webhook.event_writer import bump_events_version
 from datetime import datetime, timezone
 
 webhook_bp = Blueprint('webhook_routes', __name__, url_prefix='/webhook')
 
+# Ordinal suffix for each day of the month, indexed by day (index 0 unused).
+_DAY_SUFFIX = ['th'] * 32
+_DAY_SUFFIX[1] = _DAY_SUFFIX[21] = _DAY_SUFFIX[31] = 'st'
+_DAY_SUFFIX[2] = _DAY_SUFFIX[22] = 'nd'
+_DAY_SUFFIX[3] = _DAY_SUFFIX[23] = 'rd'
+
+# Fields read by the UI; 'timestamp' is kept for documents stored without 'timestamp_display'.
+_UI_EVENT_PROJECTION = {
+    'author': 1,
+    'action': 1,
+    'from_branch': 1,
+    'to_branch': 1,
+    'timestamp': 1,
+    'timestamp_display': 1,
+}
+
+# UI message for each stored action, filled from the event document.
+_MESSAGE_TEMPLATES = {
+    'PUSH': "{author} pushed to {to_branch} on {timestamp_display}",
+    'PULL_REQUEST': "{author} submitted a pull request from {from_branch} to {to_branch} on {timestamp_display}",
+    'MERGE': "{author} merged branch {from_branch} to {to_branch} on {timestamp_display}",
+}
+
+
+class _EventFields(dict):
+    """Event document that renders missing fields as 'N/A' in message templates."""
+
+    def __missing__(self, key):
+        return 'N/A'
+
+
+# Decode UI queries straight into _EventFields so templates can use them as-is.
+_UI_CODEC_OPTIONS = CodecOptions(document_class=_EventFields)
+
+# Lifetime of the cached /events response (app.extensions['events_cache']). Version bumps
+# only cover writes made by this process, and FAST_INSERT's unacknowledged batches can land
+# after the bump; the TTL bounds how stale either case can get.
+_EVENTS_CACHE_TTL_SECONDS = 5
+
+# Request bodies are read and hashed in chunks of this size.
+_BODY_CHUNK_SIZE = 64 * 1024
+
+# X-Hub-Signature-256 is always "sha256=" followed by 64 hex characters. Headers are
+# handled as bytes so the hex part can be decoded without another str conversion.
+_SIGNATURE_PREFIX = b"sha256="
+_SIGNATURE_LENGTH = len(_SIGNATURE_PREFIX) + 64
+
 # --- Helper Functions ---
-def verify_signature(payload_body, signature_header):
-    """Verify that the payload was sent from GitHub."""
-    secret = current_app.config.get("GITHUB_WEBHOOK_SECRET")
+def is_well_formed_signature(signature_header):
+    """Checks the public format of the signature header; says nothing about the secret."""
+    return len(signature_header) == _SIGNATURE_LENGTH and signature_header.startswith(_SIGNATURE_PREFIX)
+
+
+def read_body_with_mac(signature_header):
+    """Reads the request body in chunks, feeding each chunk into the HMAC as it arrives.
+
+    Returns the buffered body and the HMAC object. The HMAC is None, and never computed,
+    when no secret is configured or the signature header is missing or malformed.
+    """
+    secret = current_app.config.get("GITHUB_WEBHOOK_SECRET_BYTES")
+    if secret and signature_header and is_well_formed_signature(signature_header):
+        payload_mac = hmac.new(secret, digestmod="sha256")
+    else:
+        payload_mac = None
+    body = bytearray()
+    stream = request.stream
+    while True:
+        chunk = stream.read(_BODY_CHUNK_SIZE)
+        if not chunk:
+            break
+        body += chunk
+        if payload_mac is not None:
+            payload_mac.update(chunk)
+    return body, payload_mac
+
+
+def verify_signature(payload_mac, signature_header):
+    """Verify that the payload was sent from GitHub.
+
+    `payload_mac` is the HMAC object already fed with the request body (see read_body_with_mac).
+    """
+    secret = current_app.config.get("GITHUB_WEBHOOK_SECRET_BYTES")
     if not secret:
         current_app.logger.warning("GITHUB_WEBHOOK_SECRET not configured. Skipping signature verification.")
         return not signature_header
@@ -19,11 +101,20 @@ def verify_signature(payload_body, signature_header):
         current_app.logger.warning("No X-Hub-Signature-256 header received, but secret is configured.")
         return False
 
+    if not is_well_formed_signature(signature_header):
+        current_app.logger.error(f"Malformed signature header: {signature_header.decode('latin-1')}")
+        return False
+
+    try:
+        received_digest = binascii.unhexlify(signature_header[len(_SIGNATURE_PREFIX):])
+    except ValueError:
+        current_app.logger.error(f"Malformed signature header: {signature_header.decode('latin-1')}")
+        return False
+
     try:
-        hash_object = hmac.new(secret.encode('utf-8'), msg=payload_body, digestmod=hashlib.sha256)
-        expected_signature = "sha256=" + hash_object.hexdigest()
-        if not hmac.compare_digest(expected_signature, signature_header):
-            current_app.logger.error(f"Signature mismatch. Expected: {expected_signature}, Got: {signature_header}")
+        expected_digest = payload_mac.digest()
+        if not hmac.compare_digest(expected_digest, received_digest):
+            current_app.logger.error(f"Signature mismatch. Got: {signature_header.decode('latin-1')}")
             return False
         return True
     except Exception as e:
@@ -49,162 +140,227 @@ def format_timestamp_for_display(dt_string):
             dt_object = dt_object.astimezone(timezone.utc)
 
         day = dt_object.day
-        suffix = "th"
-        if day % 10 == 1 and day != 11:
-            suffix = "st"
-        elif day % 10 == 2 and day != 12:
-            suffix = "nd"
-        elif day % 10 == 3 and day != 13:
-            suffix = "rd"
-
-        return dt_object.strftime(f"%-d{suffix} %B %Y - %-I:%M %p UTC")
+        hour = dt_object.hour
+        return (f"{day}{_DAY_SUFFIX[day]} {dt_object.strftime('%B %Y')} - "
+                f"{hour % 12 or 12}:{dt_object.minute:02d} {'AM' if hour < 12 else 'PM'} UTC")
     except ValueError as e:
         current_app.logger.error(f"Timestamp formatting error: {e} for value '{dt_string}'")
         return dt_string
+    except (TypeError, AttributeError) as e:
+        # Not a string or datetime (e.g. a numeric timestamp). Runs on the write path, so a
+        # display problem must never reject the event.
+        current_app.logger.error(f"Timestamp formatting error: {e} for value '{dt_string}'")
+        return str(dt_string)
 
-# --- Webhook Receiver ---
-@webhook_bp.route('/receiver', methods=['POST'])
-def webhook_receiver():
-    if not verify_signature(request.data, request.headers.get('X-Hub-Signature-256')):
+# --- Event Builders ---
+# Shared stand-in for absent sub-objects in payloads. Never mutate it.
+_EMPTY = {}
+
+
+def _now_iso():
+    """Fallback timestamp for payloads that don't carry their own."""
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _build_push(payload):
+    ref = payload.get('ref', '')
+    head_commit = payload.get('head_commit')
+    pusher = payload.get('pusher') or _EMPTY
+    return {
+        'request_id': head_commit.get('id') if head_commit else payload.get('after', 'N/A'),
+        'author': pusher.get('name', 'N/A'),
+        'action': 'PUSH',
+        'from_branch': None,
+        'to_branch': ref.split('/')[-1] if ref.startswith('refs/heads/') else ref,
+        'timestamp': (head_commit or _EMPTY).get('timestamp') or _now_iso()
+    }
+
+
+def _build_pr_opened(payload):
+    pull_request = payload.get('pull_request') or _EMPTY
+    user = pull_request.get('user') or _EMPTY
+    head = pull_request.get('head') or _EMPTY
+    base = pull_request.get('base') or _EMPTY
+    return {
+        'request_id': str(pull_request.get('id', 'N/A')), # PR ID
+        'author': user.get('login', 'N/A'),
+        'action': 'PULL_REQUEST',
+        'from_branch': head.get('ref', 'N/A'),
+        'to_branch': base.get('ref', 'N/A'),
+        'timestamp': pull_request.get('created_at') or _now_iso()
+    }
+
+
+def _build_pr_merged(payload):
+    pull_request = payload.get('pull_request') or _EMPTY
+    merged_by = pull_request.get('merged_by') or _EMPTY
+    user = pull_request.get('user') or _EMPTY
+    head = pull_request.get('head') or _EMPTY
+    base = pull_request.get('base') or _EMPTY
+    return {
+        'request_id': pull_request.get('merge_commit_sha', 'N/A'),
+        'author': merged_by.get('login') or user.get('login', 'N/A'),
+        'action': 'MERGE',
+        'from_branch': head.get('ref', 'N/A'),
+        'to_branch': base.get('ref', 'N/A'),
+        'timestamp': pull_request.get('merged_at') or _now_iso()
+    }
+
+
+# (label, builder) keyed by (X-GitHub-Event, action); see _event_key. The label is the stored
+# action and names the event in error logs and responses.
+_EVENT_BUILDERS = {
+    ('push', None): ('PUSH', _build_push),
+    ('pull_request', 'opened'): ('PULL_REQUEST', _build_pr_opened),
+    ('pull_request', 'closed_merged'): ('MERGE', _build_pr_merged),
+}
+
+
+def _event_key(event_type, payload):
+    """Maps an incoming event to its _EVENT_BUILDERS key. Merged PRs arrive as 'closed'."""
+    if event_type != 'pull_request':
+        return event_type, None
+    pr_action = payload.get('action')
+    if pr_action == 'closed' and (payload.get('pull_request') or _EMPTY).get('merged'):
+        return event_type, 'closed_merged'
+    return event_type, pr_action
+
+
+def resolve_ui_events(state):
+    """Builds the collection handle and sort key /events reads with, once at registration."""
+    app = state.app
+    recent_events = app.extensions.get("recent_events_collection")
+    if recent_events is not None:
+        # Capped collection: reverse natural order is newest-first without a sort stage.
+        source, sort_key = recent_events, '$natural'
+    else:
+        source, sort_key = app.extensions.get("events_collection"), 'timestamp'
+    if source is not None:
+        app.extensions["ui_events"] = (source.with_options(codec_options=_UI_CODEC_OPTIONS), sort_key)
+
+
+# Registered without decorator syntax: record_once returns None, which would shadow the function.
+webhook_bp.record_once(resolve_ui_events)
+
+
+# --- Signature Verification ---
+# Endpoints that receive signed GitHub deliveries.
+_SIGNED_ENDPOINTS = {'webhook_routes.webhook_receiver'}
+
+
+@webhook_bp.before_request
+def verify_webhook_request():
+    """Verifies the signature of signed deliveries and parses their payload into g.payload."""
+    if request.endpoint not in _SIGNED_ENDPOINTS:
+        return
+
+    # WSGI headers are latin-1 decoded, so this round-trips any header value to its raw bytes.
+    signature_header = request.headers.get('X-Hub-Signature-256', '').encode('latin-1')
+    body, payload_mac = read_body_with_mac(signature_header)
+    if not verify_signature(payload_mac, signature_header):
         current_app.logger.warning("Webhook signature verification failed or GITHUB_WEBHOOK_SECRET is missing while signature is present.")
         abort(403, "Request signature mismatch or configuration error.")
 
+    # Parsed exactly once; handlers read g.payload instead of touching request.json.
+    try:
+        g.payload = orjson.loads(body)
+    except orjson.JSONDecodeError as e:
+        current_app.logger.error(f"Invalid JSON payload: {e}")
+        abort(400, "Request body is not valid JSON.")
+
+# --- Webhook Receiver ---
+@webhook_bp.route('/receiver', methods=['POST'])
+def webhook_receiver():
+    payload = g.payload
     event_type = request.headers.get('X-GitHub-Event')
-    payload = request.json
     event_data = None
-    now_utc_iso = datetime.now(timezone.utc).isoformat()
 
     current_app.logger.info(f"Received event: {event_type}, Action: {payload.get('action', 'N/A')}")
 
-    if event_type == 'push':
-        try:
-            ref = payload.get('ref', '')
-            to_branch = ref.split('/')[-1] if ref.startswith('refs/heads/') else ref
-            author = payload.get('pusher', {}).get('name', 'N/A')
-            timestamp = payload.get('head_commit', {}).get('timestamp') if payload.get('head_commit') else now_utc_iso
-            request_id = payload.get('head_commit', {}).get('id') if payload.get('head_commit') else payload.get('after', 'N/A')
-
-            event_data = {
-                'request_id': request_id,
-                'author': author,
-                'action': 'PUSH',
-                'from_branch': None,
-                'to_branch': to_branch,
-                'timestamp': timestamp
-            }
-        except Exception as e:
-            current_app.logger.error(f"Error processing PUSH event: {e}", exc_info=True)
-            return jsonify({'status': 'error', 'message': 'Failed to process PUSH event'}), 500
-
-    elif event_type == 'pull_request':
-        pr_action = payload.get('action')
-        pull_request = payload.get('pull_request', {})
-
-        if pr_action == 'opened':
-            try:
-                author = pull_request.get('user', {}).get('login', 'N/A')
-                from_branch = pull_request.get('head', {}).get('ref', 'N/A')
-                to_branch = pull_request.get('base', {}).get('ref', 'N/A')
-                timestamp = pull_request.get('created_at', now_utc_iso)
-                request_id = str(pull_request.get('id', 'N/A')) # PR ID
-
-                event_data = {
-                    'request_id': request_id,
-                    'author': author,
-                    'action': 'PULL_REQUEST',
-                    'from_branch': from_branch,
-                    'to_branch': to_branch,
-                    'timestamp': timestamp
-                }
-            except Exception as e:
-                current_app.logger.error(f"Error processing PULL_REQUEST (opened) event: {e}", exc_info=True)
-                return jsonify({'status': 'error', 'message': 'Failed to process PULL_REQUEST event'}), 500
-
-        elif pr_action == 'closed' and pull_request.get('merged'):
-            try:
-                author = pull_request.get('merged_by', {}).get('login') or \
-                         pull_request.get('user', {}).get('login', 'N/A')
-                from_branch = pull_request.get('head', {}).get('ref', 'N/A')
-                to_branch = pull_request.get('base', {}).get('ref', 'N/A')
-                timestamp = pull_request.get('merged_at', now_utc_iso)
-                request_id = pull_request.get('merge_commit_sha', 'N/A')
-
-                event_data = {
-                    'request_id': request_id,
-                    'author': author,
-                    'action': 'MERGE',
-                    'from_branch': from_branch,
-                    'to_branch': to_branch,
-                    'timestamp': timestamp
-                }
-            except Exception as e:
-                current_app.logger.error(f"Error processing MERGE event (PR closed/merged): {e}", exc_info=True)
-                return jsonify({'status': 'error', 'message': 'Failed to process MERGE event'}), 500
-        else:
-            current_app.logger.info(f"Ignoring pull_request action: {pr_action} for PR #{pull_request.get('number')}")
-            return jsonify({'status': 'ignored', 'message': f'Pull request action {pr_action} not handled'}), 200
-
-    elif event_type == 'ping':
+    if event_type == 'ping':
         current_app.logger.info("Received ping event from GitHub.")
-        return jsonify({'status': 'success', 'message': 'Pong! Webhook is active.'}), 200
+        return "", 204
+
+    event_key = _event_key(event_type, payload)
+    label, builder = _EVENT_BUILDERS.get(event_key, (None, None))
+    if builder is None and event_type == 'pull_request':
+        current_app.logger.info(f"Ignoring pull_request action: {event_key[1]} for PR #{(payload.get('pull_request') or _EMPTY).get('number')}")
+        return "", 204
 
+    if builder is not None:
+        try:
+            event_data = builder(payload)
+        except Exception as e:
+            current_app.logger.error(f"Error processing {label} event: {e}", exc_info=True)
+            return jsonify({'status': 'error', 'message': f'Failed to process {label} event'}), 500
 
     if event_data:
         try:
-            document_to_insert = {
-                'request_id': event_data['request_id'],
-                'author': event_data['author'],
-                'action': event_data['action'],
-                'from_branch': event_data.get('from_branch'),
-                'to_branch': event_data['to_branch'],
-                'timestamp': event_data['timestamp']
-            }
-
-            if mongo.db is None:
-                current_app.logger.error("MongoDB client (mongo.db) is not available. Check MONGO_URI and initialization.")
+            event_data['timestamp_display'] = format_timestamp_for_display(event_data['timestamp'])
+
+            events = current_app.extensions.get("events_collection")
+            if events is None:
+                current_app.logger.error("MongoDB events collection is not available. Check MONGO_URI and initialization.")
                 return jsonify({'status': 'error', 'message': 'Database not configured'}), 500
 
-            result = mongo.db.events.insert_one(document_to_insert)
-            current_app.logger.info(f"Stored event to MongoDB with ID: {result.inserted_id}. Action: {document_to_insert['action']} by {document_to_insert['author']}")
+            event_queue = current_app.extensions.get("event_queue")
+            if event_queue is not None:
+                try:
+                    event_queue.put_nowait(event_data)
+                    current_app.logger.info(f"Queued event for MongoDB. Action: {event_data['action']} by {event_data['author']}")
+                    return jsonify({'status': 'success', 'message': 'Webhook received and queued'}), 200
+                except queue.Full:
+                    # Don't acknowledge an event the writer may never get to; store it directly.
+                    current_app.logger.warning("Event queue is full; storing event synchronously.")
+
+            result = events.insert_one(event_data)
+            recent_events = current_app.extensions.get("recent_events_collection")
+            if recent_events is not None:
+                # The event is already stored; failing here must not make GitHub redeliver it.
+                try:
+                    recent_events.insert_one(event_data)
+                except Exception as e:
+                    current_app.logger.error(f"Stored event {result.inserted_id} but failed to add it to the recent-events collection: {e}")
+            bump_events_version(current_app)
+            current_app.logger.info(f"Stored event to MongoDB with ID: {result.inserted_id}. Action: {event_data['action']} by {event_data['author']}")
             return jsonify({'status': 'success', 'message': 'Webhook received and processed'}), 200
         except Exception as e:
             current_app.logger.error(f"Error storing event to MongoDB: {e}", exc_info=True)
             return jsonify({'status': 'error', 'message': 'Failed to store event to MongoDB'}), 500
 
     current_app.logger.info(f"Event type '{event_type}' not explicitly handled or no data extracted from this action.")
-    return jsonify({'status': 'ignored', 'message': f"Event type '{event_type}' not handled or no useful data extracted for this action."}), 200
+    return "", 204
 
 @webhook_bp.route('/events', methods=['GET'])
 def get_events_for_ui():
     try:
-        if mongo.db is None:
-            current_app.logger.error("MongoDB client (mongo.db) is not available for fetching events.")
+        ui_events = current_app.extensions.get("ui_events")
+        if ui_events is None:
+            current_app.logger.error("MongoDB events collection is not available for fetching events.")
             return jsonify({"error": "Database not configured", "events": []}), 500
 
-        latest_events_cursor = mongo.db.events.find().sort('timestamp', -1).limit(20)
+        events_cache = current_app.extensions["events_cache"]
+        version = events_cache['version']
+        cached_version, built_at, cached_body = events_cache['entry']
+        if cached_version == version and time.monotonic() - built_at < _EVENTS_CACHE_TTL_SECONDS:
+            return current_app.response_class(cached_body, mimetype='application/json')
+
+        source, sort_key = ui_events
+        latest_events_cursor = source.find({}, _UI_EVENT_PROJECTION).sort(sort_key, -1).limit(20)
 
         formatted_events = []
         for event in latest_events_cursor:
-            display_event = {
-                '_id': str(event.get('_id')),
-                'author': event.get('author', 'N/A'),
-                'action': event.get('action', 'N/A'),
-                'from_branch': event.get('from_branch'), # Might be None
-                'to_branch': event.get('to_branch', 'N/A'),
-                'timestamp_formatted': format_timestamp_for_display(event.get('timestamp'))
-            }
-
-            message = "Unknown event"
-            if display_event['action'] == 'PUSH':
-                message = f"{display_event['author']} pushed to {display_event['to_branch']} on {display_event['timestamp_formatted']}"
-            elif display_event['action'] == 'PULL_REQUEST':
-                message = f"{display_event['author']} submitted a pull request from {display_event['from_branch']} to {display_event['to_branch']} on {display_event['timestamp_formatted']}"
-            elif display_event['action'] == 'MERGE':
-                message = f"{display_event['author']} merged branch {display_event['from_branch']} to {display_event['to_branch']} on {display_event['timestamp_formatted']}"
+            # Older documents predate 'timestamp_display'; format those on the fly.
+            if 'timestamp_display' not in event:
+                event['timestamp_display'] = format_timestamp_for_display(event.get('timestamp'))
 
+            template = _MESSAGE_TEMPLATES.get(event['action'])
+            message = template.format_map(event) if template else "Unknown event"
             formatted_events.append({'message': message})
 
-        return jsonify(formatted_events)
+        body = orjson.dumps(formatted_events)
+        events_cache['entry'] = (version, time.monotonic(), body)
+        return current_app.response_class(body, mimetype='application/json')
     except Exception as e:
         current_app.logger.error(f"Error fetching events for UI: {e}", exc_info=True)
         return jsonify({"error": "Failed to retrieve events", "details": str(e)}), 500
@@ -0,0 +1,41 @@
+import multiprocessing
+import os
+
+# Run with: gunicorn run:app
+# HMAC verification is CPU-bound, so use one worker per core; threads overlap MongoDB I/O.
+# Don't enable preload_app: the background event writer thread is started in create_app
+# and would not survive the fork into workers.
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+worker_class = "gthread"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+
+
+def on_starting(server):
+    """Runs once in the master before workers boot, so only one process sets up the database.
+
+    Failures are logged, never raised: the server must still start (serving /health and the UI)
+    when MongoDB is misconfigured or down, just like create_app.
+    """
+    from pymongo import MongoClient, uri_parser
+    from app.db_setup import setup_database
+
+    mongo_uri = os.getenv("MONGO_URI")
+    if not mongo_uri:
+        return
+    try:
+        database_name = uri_parser.parse_uri(mongo_uri)["database"]
+    except Exception as e:
+        server.log.error(f"Skipping database setup; invalid MONGO_URI: {e}")
+        return
+    if not database_name:
+        server.log.error("Skipping database setup; MONGO_URI does not name a database.")
+        return
+
+    client = MongoClient(mongo_uri, serverSelectionTimeoutMS=5000)
+    try:
+        setup_database(client[database_name], server.log)
+    except Exception as e:
+        server.log.error(f"Database setup failed: {e}")
+    finally:
+        client.close()
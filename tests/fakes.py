@@ -0,0 +1,121 @@
+"""In-memory stand-ins for the pymongo objects the app uses."""
+import itertools
+from types import SimpleNamespace
+
+from pymongo.errors import CollectionInvalid
+
+
+_ids = itertools.count(1)
+
+
+class FakeCursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def sort(self, key, direction):
+        if key == '$natural':
+            if direction < 0:
+                self.documents.reverse()
+        else:
+            self.documents.sort(key=lambda doc: doc.get(key) or '', reverse=direction < 0)
+        return self
+
+    def limit(self, count):
+        self.documents = self.documents[:count]
+        return self
+
+    def __iter__(self):
+        return iter(self.documents)
+
+
+class FakeCollection:
+    """Keeps documents in a list, in insertion order."""
+
+    def __init__(self, documents=None, document_class=dict, database=None, name=None, options=None):
+        self.documents = documents if documents is not None else []
+        self.document_class = document_class
+        self.database = database
+        self.name = name
+        self.collection_options = options if options is not None else {}
+        self.fail_inserts = 0
+        self.insert_many_calls = []
+
+    def with_options(self, codec_options=None, **kwargs):
+        document_class = codec_options.document_class if codec_options else self.document_class
+        view = FakeCollection(self.documents, document_class, self.database, self.name, self.collection_options)
+        # Failures and calls are tracked on the original collection.
+        view._origin = self._tracker()
+        return view
+
+    def _tracker(self):
+        return getattr(self, '_origin', self)
+
+    def options(self):
+        if self.database is not None and self.name not in self.database.existing:
+            return {}
+        return dict(self.collection_options)
+
+    def create_index(self, keys, **kwargs):
+        self._tracker().collection_options.setdefault('indexes', []).append(keys)
+
+    def insert_one(self, document):
+        tracker = self._tracker()
+        if tracker.fail_inserts:
+            tracker.fail_inserts -= 1
+            raise ConnectionError("MongoDB unavailable")
+        if self.database is not None:
+            # Like MongoDB, the first insert creates a missing collection, uncapped.
+            self.database.existing.add(self.name)
+        document.setdefault('_id', next(_ids))
+        self.documents.append(dict(document))
+        max_documents = self.collection_options.get('max')
+        if max_documents and len(self.documents) > max_documents:
+            del self.documents[0]
+        return SimpleNamespace(inserted_id=document['_id'])
+
+    def insert_many(self, documents, ordered=True):
+        tracker = self._tracker()
+        tracker.insert_many_calls.append(len(documents))
+        if tracker.fail_inserts:
+            tracker.fail_inserts -= 1
+            raise ConnectionError("MongoDB unavailable")
+        for document in documents:
+            if '_id' in document and any(doc.get('_id') == document['_id'] for doc in self.documents):
+                continue  # duplicate key, skipped by an unordered insert
+            self.insert_one(document)
+
+    def find(self, query=None, projection=None):
+        keep = set(projection) if projection else None
+        return FakeCursor([
+            self.document_class({k: v for k, v in doc.items() if keep is None or k in keep})
+            for doc in self.documents
+        ])
+
+
+class FakeDatabase:
+    """Hands out FakeCollections by name and tracks which ones exist on the server."""
+
+    def __init__(self):
+        self.collections = {}
+        self.existing = set()
+
+    def __getitem__(self, name):
+        if name not in self.collections:
+            self.collections[name] = FakeCollection(database=self, name=name)
+        return self.collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def create_collection(self, name, **options):
+        if name in self.existing:
+            raise CollectionInvalid(f"collection {name} already exists")
+        self.existing.add(name)
+        self.collections[name] = FakeCollection(database=self, name=name, options=options)
+        return self.collections[name]
+
+    def drop_collection(self, name):
+        self.existing.discard(name)
+        self.collections.pop(name, None)
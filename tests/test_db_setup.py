@@ -0,0 +1,69 @@
+import logging
+
+from app.db_setup import (
+    RECENT_EVENTS_COLLECTION,
+    RECENT_EVENTS_MAX,
+    is_recent_events_collection_ready,
+    setup_database,
+)
+from tests.fakes import FakeDatabase
+
+logger = logging.getLogger(__name__)
+
+
+def make_db(*timestamps):
+    db = FakeDatabase()
+    for timestamp in timestamps:
+        db.events.insert_one({'request_id': timestamp, 'timestamp': timestamp})
+    return db
+
+
+def test_setup_creates_index_and_seeds_capped_collection_in_timestamp_order():
+    db = make_db('2021-04-02T00:00:00Z', '2021-04-03T00:00:00Z', '2021-04-01T00:00:00Z')
+
+    setup_database(db, logger)
+
+    assert db.events.options()['indexes'] == [[('timestamp', -1)]]
+    recent = db[RECENT_EVENTS_COLLECTION]
+    assert recent.options()['capped'] is True
+    assert recent.options()['max'] == RECENT_EVENTS_MAX
+    assert [doc['timestamp'] for doc in recent.documents] == [
+        '2021-04-01T00:00:00Z', '2021-04-02T00:00:00Z', '2021-04-03T00:00:00Z',
+    ]
+
+
+def test_setup_rebuilds_an_uncapped_recent_collection():
+    db = make_db('2021-04-01T00:00:00Z')
+    # Auto-created by a plain insert, so it has no size or document limit.
+    db[RECENT_EVENTS_COLLECTION].insert_one({'request_id': 'stray', 'timestamp': '2021-03-01T00:00:00Z'})
+    assert not db[RECENT_EVENTS_COLLECTION].options().get('capped')
+
+    setup_database(db, logger)
+
+    recent = db[RECENT_EVENTS_COLLECTION]
+    assert recent.options()['capped'] is True
+    assert recent.options()['max'] == RECENT_EVENTS_MAX
+    assert [doc['request_id'] for doc in recent.documents] == ['2021-04-01T00:00:00Z']
+
+
+def test_setup_leaves_an_existing_capped_collection_alone():
+    db = make_db('2021-04-01T00:00:00Z', '2021-04-02T00:00:00Z')
+    setup_database(db, logger)
+    db[RECENT_EVENTS_COLLECTION].insert_one({'request_id': 'live', 'timestamp': '2021-04-03T00:00:00Z'})
+
+    setup_database(db, logger)
+
+    assert [doc['request_id'] for doc in db[RECENT_EVENTS_COLLECTION].documents] == [
+        '2021-04-01T00:00:00Z', '2021-04-02T00:00:00Z', 'live',
+    ]
+
+
+def test_recent_collection_is_ready_only_once_capped():
+    db = make_db('2021-04-01T00:00:00Z')
+    assert not is_recent_events_collection_ready(db, logger)
+
+    db[RECENT_EVENTS_COLLECTION].insert_one({'request_id': 'stray'})
+    assert not is_recent_events_collection_ready(db, logger)
+
+    setup_database(db, logger)
+    assert is_recent_events_collection_ready(db, logger)
@@ -0,0 +1,95 @@
+import logging
+import queue
+import threading
+import time
+
+import pytest
+from flask import Flask
+
+from app.webhook import event_writer
+from app.webhook.event_writer import _STOP, _flush_events, init_events_cache, stop_event_writer
+from tests.fakes import FakeCollection
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    init_events_cache(app)
+    app.extensions["events_collection"] = FakeCollection()
+    return app
+
+
+def queued(*request_ids, stop=True):
+    event_queue = queue.Queue()
+    for request_id in request_ids:
+        event_queue.put({'request_id': request_id})
+    if stop:
+        event_queue.put(_STOP)
+    return event_queue
+
+
+def stored(collection):
+    return [doc['request_id'] for doc in collection.documents]
+
+
+def test_writes_in_batches_of_at_most_max_batch(app, monkeypatch):
+    monkeypatch.setattr(event_writer, "_FLUSH_MAX_BATCH", 2)
+    app.extensions["recent_events_collection"] = recent = FakeCollection()
+
+    _flush_events(app, queued('a', 'b', 'c', 'd', 'e'))
+
+    events = app.extensions["events_collection"]
+    assert events.insert_many_calls == [2, 2, 1]
+    assert stored(events) == ['a', 'b', 'c', 'd', 'e']
+    assert stored(recent) == ['a', 'b', 'c', 'd', 'e']
+    assert app.extensions["events_cache"]['version'] == 3
+
+
+def test_stop_drains_events_queued_before_it(app):
+    event_queue = queued('a', 'b')
+    event_queue.put({'request_id': 'after stop'})
+
+    _flush_events(app, event_queue)
+
+    assert stored(app.extensions["events_collection"]) == ['a', 'b']
+    assert event_queue.get_nowait()['request_id'] == 'after stop'
+
+
+def test_failed_batch_is_retried(app):
+    events = app.extensions["events_collection"]
+    events.fail_inserts = 1
+
+    _flush_events(app, queued('a', 'b', 'c'))
+
+    assert events.insert_many_calls == [3, 3]
+    assert stored(events) == ['a', 'b', 'c']
+    assert app.extensions["events_cache"]['version'] == 1
+
+
+def test_batch_is_dropped_after_repeated_failures(app, caplog):
+    events = app.extensions["events_collection"]
+    events.fail_inserts = 2
+
+    with caplog.at_level(logging.ERROR):
+        _flush_events(app, queued('a', 'b', 'c'))
+
+    assert events.insert_many_calls == [3, 3]
+    assert events.documents == []
+    assert app.extensions["events_cache"]['version'] == 0
+    assert "Dropped 3 event(s) after 2 failed attempts: ['a', 'b', 'c']" in caplog.text
+
+
+def test_version_is_bumped_again_once_the_queue_settles(app, monkeypatch):
+    monkeypatch.setattr(event_writer, "_SETTLE_SECONDS", 0.01)
+    event_queue = queued('a', stop=False)
+    thread = threading.Thread(target=_flush_events, args=(app, event_queue), daemon=True)
+    thread.start()
+
+    deadline = time.monotonic() + 2
+    while app.extensions["events_cache"]['version'] < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    stop_event_writer(app, thread, event_queue)
+
+    # Once for the flush, once more after the idle period.
+    assert app.extensions["events_cache"]['version'] == 2
+    assert not thread.is_alive()
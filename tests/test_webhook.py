@@ -0,0 +1,254 @@
+import hmac
+import json
+import queue
+from types import SimpleNamespace
+
+import pytest
+
+from app import create_app
+from app.webhook import routes
+from app.webhook.routes import resolve_ui_events
+from tests.fakes import FakeCollection
+
+SECRET = "s3cr3t"
+
+
+@pytest.fixture
+def make_app(monkeypatch):
+    def _make_app(secret=SECRET, recent_events=None):
+        monkeypatch.delenv("MONGO_URI", raising=False)
+        monkeypatch.setenv("FAST_INSERT", "false")
+        if secret:
+            monkeypatch.setenv("GITHUB_WEBHOOK_SECRET", secret)
+        else:
+            monkeypatch.delenv("GITHUB_WEBHOOK_SECRET", raising=False)
+
+        app = create_app()
+        events = FakeCollection()
+        app.extensions["events_collection"] = events
+        if recent_events is not None:
+            app.extensions["recent_events_collection"] = recent_events
+        resolve_ui_events(SimpleNamespace(app=app))
+        app.events = events
+        return app
+    return _make_app
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+def sign(body, secret=SECRET):
+    return "sha256=" + hmac.new(secret.encode(), body, "sha256").hexdigest()
+
+
+def post_event(client, event_type, payload, signature=None, body=None):
+    body = body if body is not None else json.dumps(payload).encode()
+    headers = {'X-GitHub-Event': event_type, 'Content-Type': 'application/json'}
+    signature = sign(body) if signature is None else signature
+    if signature:
+        headers['X-Hub-Signature-256'] = signature
+    return client.post('/webhook/receiver', data=body, headers=headers)
+
+
+PUSH = {
+    "ref": "refs/heads/main",
+    "pusher": {"name": "Travis"},
+    "head_commit": {"id": "abc123", "timestamp": "2021-04-01T21:30:00Z"},
+}
+PR_OPENED = {
+    "action": "opened",
+    "pull_request": {
+        "id": 42, "user": {"login": "Travis"}, "head": {"ref": "dev"}, "base": {"ref": "main"},
+        "created_at": "2021-04-01T09:00:00Z",
+    },
+}
+PR_MERGED = {
+    "action": "closed",
+    "pull_request": {
+        "merged": True, "merge_commit_sha": "def456", "merged_by": {"login": "Maya"},
+        "user": {"login": "Travis"}, "head": {"ref": "dev"}, "base": {"ref": "main"},
+        "merged_at": "2021-04-02T12:00:00Z",
+    },
+}
+
+
+def test_valid_signature_is_accepted(app):
+    assert post_event(app.test_client(), 'push', PUSH).status_code == 200
+
+
+def test_wrong_signature_is_rejected(app):
+    response = post_event(app.test_client(), 'push', PUSH, signature=sign(b"other body"))
+    assert response.status_code == 403
+    assert app.events.documents == []
+
+
+def test_missing_signature_is_rejected(app):
+    assert post_event(app.test_client(), 'push', PUSH, signature="").status_code == 403
+
+
+@pytest.mark.parametrize("signature", [
+    "sha256=" + "z" * 64,       # right length, not hex
+    "sha256=" + "0" * 63,       # too short
+    "sha1=" + "0" * 66,         # right length, wrong prefix
+])
+def test_malformed_signature_is_rejected(app, signature):
+    assert post_event(app.test_client(), 'push', PUSH, signature=signature).status_code == 403
+
+
+def test_signature_without_configured_secret_is_rejected(make_app):
+    app = make_app(secret=None)
+    assert post_event(app.test_client(), 'push', PUSH).status_code == 403
+
+
+def test_unsigned_request_without_configured_secret_is_accepted(make_app):
+    app = make_app(secret=None)
+    assert post_event(app.test_client(), 'push', PUSH, signature="").status_code == 200
+
+
+def test_invalid_json_is_rejected(app):
+    body = b"{not json"
+    response = post_event(app.test_client(), 'push', None, body=body, signature=sign(body))
+    assert response.status_code == 400
+
+
+def test_ping_returns_no_content(app):
+    response = post_event(app.test_client(), 'ping', {"zen": "Keep it logically awesome."})
+    assert response.status_code == 204
+    assert response.data == b""
+
+
+def test_ignored_pull_request_action_returns_no_content(app):
+    response = post_event(app.test_client(), 'pull_request', {"action": "labeled", "pull_request": {"number": 7}})
+    assert response.status_code == 204
+    assert app.events.documents == []
+
+
+@pytest.mark.parametrize("event_type, payload, expected", [
+    ('push', PUSH, {
+        'request_id': 'abc123', 'author': 'Travis', 'action': 'PUSH', 'from_branch': None,
+        'to_branch': 'main', 'timestamp': '2021-04-01T21:30:00Z',
+        'timestamp_display': '1st April 2021 - 9:30 PM UTC',
+    }),
+    ('pull_request', PR_OPENED, {
+        'request_id': '42', 'author': 'Travis', 'action': 'PULL_REQUEST', 'from_branch': 'dev',
+        'to_branch': 'main', 'timestamp': '2021-04-01T09:00:00Z',
+        'timestamp_display': '1st April 2021 - 9:00 AM UTC',
+    }),
+    ('pull_request', PR_MERGED, {
+        'request_id': 'def456', 'author': 'Maya', 'action': 'MERGE', 'from_branch': 'dev',
+        'to_branch': 'main', 'timestamp': '2021-04-02T12:00:00Z',
+        'timestamp_display': '2nd April 2021 - 12:00 PM UTC',
+    }),
+])
+def test_event_is_stored_with_display_timestamp(app, event_type, payload, expected):
+    assert post_event(app.test_client(), event_type, payload).status_code == 200
+    [stored] = app.events.documents
+    stored.pop('_id')
+    assert stored == expected
+
+
+@pytest.mark.parametrize("event_type, payload, label", [
+    ('push', {**PUSH, "head_commit": {"id": "x", "timestamp": "t"}, "pusher": "not-a-dict"}, 'PUSH'),
+    ('pull_request', {**PR_OPENED, "pull_request": {**PR_OPENED["pull_request"], "user": "x"}}, 'PULL_REQUEST'),
+    ('pull_request', {**PR_MERGED, "pull_request": {**PR_MERGED["pull_request"], "merged_by": "x"}}, 'MERGE'),
+])
+def test_builder_errors_name_the_event(app, event_type, payload, label):
+    response = post_event(app.test_client(), event_type, payload)
+    assert response.status_code == 500
+    assert response.get_json()['message'] == f'Failed to process {label} event'
+
+
+def test_event_is_queued_when_writer_is_running(app):
+    app.extensions["event_queue"] = event_queue = queue.Queue(maxsize=1)
+    response = post_event(app.test_client(), 'push', PUSH)
+    assert response.get_json()['message'] == 'Webhook received and queued'
+    assert event_queue.get_nowait()['request_id'] == 'abc123'
+    assert app.events.documents == []
+
+
+def test_event_is_stored_directly_when_queue_is_full(app):
+    app.extensions["event_queue"] = event_queue = queue.Queue(maxsize=1)
+    event_queue.put_nowait({'request_id': 'waiting'})
+    response = post_event(app.test_client(), 'push', PUSH)
+    assert response.get_json()['message'] == 'Webhook received and processed'
+    assert [doc['request_id'] for doc in app.events.documents] == ['abc123']
+
+
+def test_event_with_non_string_timestamp_is_still_stored(app):
+    payload = {**PR_OPENED, "pull_request": {**PR_OPENED["pull_request"], "created_at": 12345}}
+    assert post_event(app.test_client(), 'pull_request', payload).status_code == 200
+    [stored] = app.events.documents
+    assert stored['timestamp'] == 12345
+    assert stored['timestamp_display'] == '12345'
+
+
+def test_events_renders_messages_for_legacy_documents(app):
+    # Stored before 'timestamp_display' existed, one of them without an author.
+    app.events.documents.extend([
+        {'action': 'PUSH', 'author': 'Travis', 'to_branch': 'main', 'timestamp': '2021-04-01T21:30:00Z'},
+        {'action': 'MERGE', 'from_branch': 'dev', 'to_branch': 'main', 'timestamp': '2021-04-22T12:00:00+00:00'},
+        {'action': 'SOMETHING_ELSE', 'timestamp': '2021-03-01T00:00:00Z'},
+    ])
+
+    response = app.test_client().get('/webhook/events')
+
+    assert response.status_code == 200
+    assert response.get_json() == [
+        {'message': "N/A merged branch dev to main on 22nd April 2021 - 12:00 PM UTC"},
+        {'message': "Travis pushed to main on 1st April 2021 - 9:30 PM UTC"},
+        {'message': "Unknown event"},
+    ]
+
+
+def test_events_reads_capped_collection_newest_first(make_app):
+    recent = FakeCollection()
+    app = make_app(recent_events=recent)
+    client = app.test_client()
+    # Arrival order wins over the payload timestamps.
+    assert post_event(client, 'pull_request', PR_MERGED).status_code == 200
+    assert post_event(client, 'push', PUSH).status_code == 200
+    assert len(recent.documents) == 2
+
+    response = client.get('/webhook/events')
+
+    assert response.get_json() == [
+        {'message': "Travis pushed to main on 1st April 2021 - 9:30 PM UTC"},
+        {'message': "Maya merged branch dev to main on 2nd April 2021 - 12:00 PM UTC"},
+    ]
+
+
+PUSH_MESSAGE = {'message': "Travis pushed to main on 1st April 2021 - 9:30 PM UTC"}
+MERGE_MESSAGE = {'message': "Maya merged branch dev to main on 2nd April 2021 - 12:00 PM UTC"}
+
+
+def test_events_shows_an_event_posted_after_the_last_read(app):
+    client = app.test_client()
+    assert client.get('/webhook/events').get_json() == []
+
+    assert post_event(client, 'push', PUSH).status_code == 200
+
+    assert client.get('/webhook/events').get_json() == [PUSH_MESSAGE]
+
+
+def test_events_serves_cached_body_while_version_is_unchanged(app):
+    client = app.test_client()
+    post_event(client, 'push', PUSH)
+    first = client.get('/webhook/events').data
+    # Written behind the app's back, so the version isn't bumped.
+    app.events.documents.append({'action': 'MERGE', 'author': 'Maya', 'from_branch': 'dev', 'to_branch': 'main',
+                                 'timestamp': '2021-04-02T12:00:00Z'})
+
+    assert client.get('/webhook/events').data == first
+
+
+def test_events_rebuilds_cached_body_once_ttl_expires(app, monkeypatch):
+    client = app.test_client()
+    post_event(client, 'push', PUSH)
+    client.get('/webhook/events')
+    app.events.documents.append({'action': 'MERGE', 'author': 'Maya', 'from_branch': 'dev', 'to_branch': 'main',
+                                 'timestamp': '2021-04-02T12:00:00Z'})
+    monkeypatch.setattr(routes, "_EVENTS_CACHE_TTL_SECONDS", 0)
+
+    assert client.get('/webhook/events').get_json() == [MERGE_MESSAGE, PUSH_MESSAGE]